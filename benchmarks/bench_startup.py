@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Startup time and memory per worker.
+
+    DJANGO_SETTINGS_MODULE=config.settings python bench_startup.py imports [--warmup] [--runs 5]
+    python bench_startup.py workers <gunicorn master pid>
+
+imports times django.setup() and `import betting.views` in fresh interpreters and
+prints the peak RSS of each. workers prints RSS and PSS of every child of the
+gunicorn master, PSS counts the copy-on-write shared pages once across workers.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+_CHILD = '''
+import json, resource, time
+t0 = time.time()
+import django
+django.setup()
+t1 = time.time()
+import betting.views
+t2 = time.time()
+if {warmup}:
+    from betting.warmup import warmup
+    warmup()
+t3 = time.time()
+print(json.dumps({{'setup': t1 - t0, 'views': t2 - t1, 'warmup': t3 - t2,
+                  'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+'''
+
+
+def bench_imports(runs, warmup):
+    results = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', _CHILD.format(warmup=bool(warmup))])
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    for key in ('setup', 'views', 'warmup', 'maxrss_kb'):
+        values = sorted(r[key] for r in results)
+        print('{0:<10} min {1:>10.3f}  median {2:>10.3f}  max {3:>10.3f}'.format(
+            key, values[0], values[len(values) // 2], values[-1]))
+
+
+def _children(pid):
+    ret = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(name)) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            ret.append(int(name))
+    return sorted(ret)
+
+
+def _memory_kb(pid):
+    rss = pss = 0
+    with open('/proc/{0}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    smaps = '/proc/{0}/smaps_rollup'.format(pid)
+    if not os.path.exists(smaps):
+        smaps = '/proc/{0}/smaps'.format(pid)
+    with open(smaps) as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                pss += int(line.split()[1])
+    return rss, pss
+
+
+def bench_workers(master):
+    pids = [master] + _children(master)
+    total_rss = total_pss = 0
+    print('{0:>8} {1:>12} {2:>12}'.format('pid', 'rss_kb', 'pss_kb'))
+    for pid in pids:
+        rss, pss = _memory_kb(pid)
+        total_rss += rss
+        total_pss += pss
+        print('{0:>8} {1:>12} {2:>12}{3}'.format(pid, rss, pss, '  master' if pid == master else ''))
+    print('{0:>8} {1:>12} {2:>12}'.format('total', total_rss, total_pss))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='mode')
+    imports = sub.add_parser('imports')
+    imports.add_argument('--runs', type=int, default=5)
+    imports.add_argument('--warmup', action='store_true', default=False)
+    workers = sub.add_parser('workers')
+    workers.add_argument('pid', type=int)
+    args = parser.parse_args()
+    if args.mode == 'imports':
+        bench_imports(args.runs, args.warmup)
+    else:
+        bench_workers(args.pid)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import atexit
+import calendar
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import redis
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone as dt
+
+from betting.models import Message, Room
+from betting.serializers import SteamerSerializer
+
+
+_logger = logging.getLogger(__name__)
+
+CHAT_REDIS_URL = getattr(settings, 'CHAT_REDIS_URL', 'redis://127.0.0.1:6379/0')
+CHAT_BUFFER_SIZE = getattr(settings, 'CHAT_BUFFER_SIZE', 100)
+CHAT_FLUSH_INTERVAL = getattr(settings, 'CHAT_FLUSH_INTERVAL', 1.0)
+CHAT_FLUSH_BATCH = getattr(settings, 'CHAT_FLUSH_BATCH', 500)
+CHAT_FLUSH_RETRIES = getattr(settings, 'CHAT_FLUSH_RETRIES', 3)
+CHAT_HISTORY_PAGE = getattr(settings, 'CHAT_HISTORY_PAGE', 50)
+CHAT_RETENTION_DAYS = getattr(settings, 'CHAT_RETENTION_DAYS', 30)
+CHAT_PRUNE_CHUNK = getattr(settings, 'CHAT_PRUNE_CHUNK', 1000)
+
+_BACKLOG_KEY = 'chat_backlog_{0}'
+_LOADED_KEY = 'chat_backlog_loaded_{0}'
+
+# The backlog of every room is a redis list shared by all workers. The messages
+# are written to database by the worker which received them, in batches, each
+# pending entry is [message, failed tries].
+_redis = redis.StrictRedis.from_url(CHAT_REDIS_URL)
+_pending = []
+_lock = threading.Lock()
+_flusher = None
+_last_ts = [None]
+
+
+def _to_cursor(ts, msg_id=None):
+    """
+    Cursor of a message, '<microseconds>_<id>'. A message not saved yet has no id
+    and its cursor is '<microseconds>'. Aware timestamps are counted in UTC, naive
+    ones (USE_TZ = False) as they are, _from_cursor turns them back the same way.
+    """
+    if dt.is_aware(ts):
+        ts = dt.make_naive(ts, dt.utc)
+    micro = calendar.timegm(ts.timetuple()) * 1000000 + ts.microsecond
+    return '{0}_{1}'.format(micro, msg_id) if msg_id else str(micro)
+
+
+def _from_cursor(cursor):
+    micro, _, msg_id = str(cursor).partition('_')
+    micro = int(micro)
+    ts = datetime.utcfromtimestamp(micro // 1000000).replace(microsecond=micro % 1000000)
+    if settings.USE_TZ:
+        ts = dt.make_aware(ts, dt.utc)
+    return ts, int(msg_id) if msg_id else None
+
+
+def _room_id(room):
+    return room.id if isinstance(room, Room) else room
+
+
+def render_message(msg):
+    return {
+        'room': msg.room_id,
+        'steamer': SteamerSerializer(msg.steamer).data,
+        'message': msg.message,
+        'timestamp': msg.formatted_timestamp,
+        'cursor': _to_cursor(msg.timestamp, msg.id)
+    }
+
+
+def _ensure_backlog(room_id):
+    """
+    Fills the redis backlog of a room from database the first time it is used,
+    the query runs without any lock and only the first loader wins.
+    """
+    loaded_key = _LOADED_KEY.format(room_id)
+    if _redis.exists(loaded_key):
+        return
+    msgs = Message.objects.select_related('steamer').filter(
+        room_id=room_id
+    ).order_by('-timestamp', '-id')[:CHAT_BUFFER_SIZE]
+    payloads = [json.dumps(render_message(m)) for m in reversed(list(msgs))]
+    key = _BACKLOG_KEY.format(room_id)
+
+    def fill(pipe):
+        if pipe.exists(loaded_key):
+            return
+        pipe.multi()
+        pipe.delete(key)
+        if payloads:
+            pipe.rpush(key, *payloads)
+        pipe.set(loaded_key, 1)
+    _redis.transaction(fill, loaded_key)
+
+
+def get_room_backlog(room, count=None):
+    room_id = _room_id(room)
+    count = CHAT_BUFFER_SIZE if count is None else min(count, CHAT_BUFFER_SIZE)
+    if count <= 0:
+        return []
+    _ensure_backlog(room_id)
+    return [json.loads(m) for m in _redis.lrange(_BACKLOG_KEY.format(room_id), -count, -1)]
+
+
+def _next_timestamp():
+    # keep timestamps of this worker strictly increasing, other workers may still
+    # write the same microsecond, the history pages on (timestamp, id) for them
+    ts = dt.now()
+    with _lock:
+        if _last_ts[0] is not None and ts <= _last_ts[0]:
+            ts = _last_ts[0] + timedelta(microseconds=1)
+        _last_ts[0] = ts
+    return ts
+
+
+def post_message(room, steamer, message):
+    room_id = _room_id(room)
+    msg = Message(steamer=steamer, room_id=room_id, message=message, timestamp=_next_timestamp())
+    data = render_message(msg)
+    _ensure_backlog(room_id)
+    key = _BACKLOG_KEY.format(room_id)
+    pipe = _redis.pipeline()
+    pipe.rpush(key, json.dumps(data))
+    pipe.ltrim(key, -CHAT_BUFFER_SIZE, -1)
+    pipe.execute()
+    with _lock:
+        _pending.append([msg, 0])
+        full = len(_pending) >= CHAT_FLUSH_BATCH
+    _ensure_flusher()
+    if full:
+        flush_messages()
+    return data
+
+
+def _save_one_by_one(batch):
+    """
+    Called when the batch insert fails, saves the rows alone so one bad row does
+    not block the others. Rows failing CHAT_FLUSH_RETRIES times are dropped.
+    """
+    retry = []
+    saved = 0
+    for entry in batch:
+        msg = entry[0]
+        try:
+            msg.save()
+            saved += 1
+        except Exception as e:
+            entry[1] += 1
+            if entry[1] >= CHAT_FLUSH_RETRIES:
+                _logger.error('drop chat message of %s in room %s after %s tries: %s',
+                              msg.steamer_id, msg.room_id, entry[1], e)
+            else:
+                retry.append(entry)
+    return saved, retry
+
+
+def flush_messages():
+    global _pending
+    with _lock:
+        if not _pending:
+            return 0
+        batch, _pending = _pending, []
+    try:
+        Message.objects.bulk_create([entry[0] for entry in batch], batch_size=CHAT_FLUSH_BATCH)
+        return len(batch)
+    except Exception as e:
+        _logger.warning('bulk insert of %s chat messages failed: %s', len(batch), e)
+    saved, retry = _save_one_by_one(batch)
+    if retry:
+        with _lock:
+            _pending = retry + _pending
+    return saved
+
+
+def _flush_loop():
+    while True:
+        time.sleep(CHAT_FLUSH_INTERVAL)
+        try:
+            flush_messages()
+        except Exception as e:
+            _logger.exception(e)
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='chat-flusher')
+            _flusher.daemon = True
+            _flusher.start()
+            atexit.register(flush_messages)
+
+
+def get_room_history(room, before=None, count=CHAT_HISTORY_PAGE):
+    """
+    Keyset pagination on (timestamp, id) of the room, returns messages older than
+    the cursor, newest first. Pass the cursor of the last message of previous page
+    as before. A cursor without id, from a message not saved when it was sent, also
+    returns the messages of its own microsecond, so ties are repeated, not lost.
+    """
+    query = Message.objects.select_related('steamer').filter(room_id=_room_id(room))
+    if before is not None:
+        ts, msg_id = _from_cursor(before)
+        if msg_id is None:
+            query = query.filter(timestamp__lte=ts)
+        else:
+            query = query.filter(Q(timestamp__lt=ts) | Q(timestamp=ts, id__lt=msg_id))
+    msgs = query.order_by('-timestamp', '-id')[:count]
+    return [render_message(m) for m in msgs]
+
+
+def prune_messages(days=CHAT_RETENTION_DAYS, chunk=CHAT_PRUNE_CHUNK):
+    deadline = dt.now() - timedelta(days=days)
+    total = 0
+    while True:
+        ids = list(Message.objects.filter(timestamp__lt=deadline).order_by('timestamp').values_list('id', flat=True)[:chunk])
+        if not ids:
+            break
+        Message.objects.filter(id__in=ids).delete()
+        total += len(ids)
+    _logger.info('pruned %s chat messages before %s', total, deadline)
+    return total
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import csv
+import json
+import calendar
+import logging
+from collections import OrderedDict
+
+from django.db.models import Min, Max
+from django.db.models.fields.related import ForeignKey
+from django.utils import timezone as dt
+
+from betting.models import CoinFlipGame, Deposit, PropItem, SendRecord, UserAmountRecord
+
+
+_logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK = 2000
+
+# model, lookup of the game type filter
+EXPORT_MODELS = {
+    'games': (CoinFlipGame, 'game_type'),
+    'deposits': (Deposit, 'game_type'),
+    'items': (PropItem, 'deposit__game_type'),
+    'sends': (SendRecord, 'game__game_type'),
+    'amounts': (UserAmountRecord, 'game__game_type'),
+}
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def _to_timestamp(val):
+    return calendar.timegm(val.timetuple()) if val is not None else None
+
+
+def _to_text(val):
+    return val.encode('utf-8') if isinstance(val, unicode) else val
+
+
+def build_column_plan(model):
+    """
+    Returns (names, columns, converters) computed once per export, columns are
+    passed to values_list so no model instance is built per row.
+    """
+    names = []
+    columns = []
+    converters = []
+    for f in model._meta.concrete_fields:
+        names.append(f.name)
+        columns.append(f.attname if isinstance(f, ForeignKey) else f.name)
+        if f.get_internal_type() == 'DateTimeField':
+            converters.append(_to_timestamp)
+        else:
+            converters.append(None)
+    return names, columns, converters
+
+
+def first_id_since(model, ts):
+    """
+    Smallest id whose create_time >= ts, found by binary search on the primary key.
+    create_time is not indexed but is set on insert, so it grows with id.
+    """
+    bounds = model.objects.order_by().aggregate(lo=Min('id'), hi=Max('id'))
+    if bounds['lo'] is None:
+        return 0
+    lo, hi = bounds['lo'], bounds['hi'] + 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        row = model.objects.filter(id__gte=mid).order_by('id').values_list('id', 'create_time').first()
+        if row is None or row[1] >= ts:
+            hi = mid
+        else:
+            lo = row[0] + 1
+    return lo
+
+
+def iter_export_rows(target, start=None, end=None, game_type=None, chunk=EXPORT_CHUNK):
+    """
+    Yields converted rows of the target in keyset chunks on id, every chunk is a
+    short query so the database is not held by one long running cursor. The date
+    range is turned into id bounds first, so chunks never scan outside of it.
+    """
+    model, type_lookup = EXPORT_MODELS[target]
+    names, columns, converters = build_column_plan(model)
+    plan = [(i, c) for i, c in enumerate(converters) if c is not None]
+    query = model.objects.order_by()
+    if start is not None:
+        query = query.filter(create_time__gte=start)
+    if end is not None:
+        query = query.filter(create_time__lt=end)
+        query = query.filter(id__lt=first_id_since(model, end))
+    if game_type is not None:
+        query = query.filter(**{type_lookup: game_type})
+    id_pos = columns.index('id')
+    last_id = first_id_since(model, start) - 1 if start is not None else 0
+    while True:
+        rows = list(query.filter(id__gt=last_id).order_by('id').values_list(*columns)[:chunk])
+        if not rows:
+            break
+        last_id = rows[-1][id_pos]
+        for row in rows:
+            if plan:
+                row = list(row)
+                for i, c in plan:
+                    row[i] = c(row[i])
+            yield row
+
+
+class _Echo(object):
+    def write(self, value):
+        return value
+
+
+def iter_export_lines(target, fmt='csv', **filters):
+    model, _ = EXPORT_MODELS[target]
+    names = build_column_plan(model)[0]
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(names)
+        for row in iter_export_rows(target, **filters):
+            yield writer.writerow([_to_text(v) for v in row])
+    else:
+        for row in iter_export_rows(target, **filters):
+            # keys follow the column plan, a plain dict has no order on Python 2
+            yield json.dumps(OrderedDict(zip(names, row)), ensure_ascii=False) + '\n'
+
+
+def parse_export_date(val):
+    if not val:
+        return None
+    ret = dt.datetime.strptime(val, '%Y-%m-%d')
+    return dt.make_aware(ret) if dt.is_naive(ret) else ret
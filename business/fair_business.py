@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+
+from betting.business.deposit_business import make_game_hash
+from betting.business.export_business import first_id_since
+from betting.models import CoinFlipGame
+
+
+_logger = logging.getLogger(__name__)
+
+FAIR_BATCH_MAX = getattr(settings, 'FAIR_BATCH_MAX', 5000)
+FAIR_CACHE_TIMEOUT = getattr(settings, 'FAIR_CACHE_TIMEOUT', 7 * 24 * 3600)
+FAIR_CACHE_PREFIX = 'fair_verify_v2_'
+
+_FIELDS = ('uid', 'hash', 'secret', 'percentage', 'total_tickets', 'win_ticket')
+
+
+def win_tickets(percentage, total_tickets):
+    """
+    get_win_ticket of the settlement on arrays, floor(percentage * total_tickets)
+    in float64 like the Python float math. tests.test_fair_business checks it
+    against get_win_ticket.
+    """
+    percentage = np.asarray(percentage, dtype=np.float64)
+    total_tickets = np.asarray(total_tickets, dtype=np.int64)
+    return np.floor(percentage * total_tickets).astype(np.int64)
+
+
+def _verify_rows(rows):
+    """
+    Recomputes hash and win ticket of the rows. The hash uses make_game_hash of
+    create_random_hash row by row, the win tickets of all rows are computed and
+    compared at once.
+    """
+    count = len(rows)
+    percentage = np.fromiter((r['percentage'] for r in rows), dtype=np.float64, count=count)
+    tickets = np.fromiter((r['total_tickets'] for r in rows), dtype=np.int64, count=count)
+    win_ticket = np.fromiter((r['win_ticket'] for r in rows), dtype=np.int64, count=count)
+    expected = win_tickets(percentage, tickets)
+    ticket_ok = expected == win_ticket
+    ret = []
+    for i, r in enumerate(rows):
+        hash_ok = make_game_hash(r['secret'], r['percentage']) == r['hash']
+        ret.append({
+            'uid': r['uid'],
+            'hash': r['hash'],
+            'secret': r['secret'],
+            'percentage': r['percentage'],
+            'total_tickets': r['total_tickets'],
+            'win_ticket': r['win_ticket'],
+            'expected_ticket': int(expected[i]),
+            'hash_ok': hash_ok,
+            'ticket_ok': bool(ticket_ok[i]),
+            'ok': hash_ok and bool(ticket_ok[i])
+        })
+    return ret
+
+
+def verify_games(uids=None, start=None, end=None, after=None, limit=FAIR_BATCH_MAX):
+    """
+    Verifies ended games by uids or by create time range, the payloads are cached
+    since ended games do not change. Games not ended are never returned because
+    their secret is not public yet.
+
+    Returns (results, mismatches, cursor). A date range is paged like the export,
+    in keyset order on id within the id bounds of the range, limit games a page.
+    cursor is the id to pass as after for the next page, None when the range is
+    complete. More than limit uids are rejected instead of cut.
+    """
+    query = CoinFlipGame.objects.filter(end=1).order_by()
+    last_id = after or 0
+    if uids is not None:
+        if not isinstance(uids, (list, tuple)):
+            raise ValueError('uids must be a list')
+        if len(uids) > limit:
+            raise ValueError('at most {0} uids can be verified at once'.format(limit))
+        query = query.filter(uid__in=[unicode(u) for u in uids])
+    else:
+        if start is not None:
+            query = query.filter(create_time__gte=start)
+            last_id = max(last_id, first_id_since(CoinFlipGame, start) - 1)
+        if end is not None:
+            query = query.filter(create_time__lt=end, id__lt=first_id_since(CoinFlipGame, end))
+    found = list(query.filter(id__gt=last_id).order_by('id').values_list('id', 'uid')[:limit + 1])
+    cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        cursor = found[-1][0]
+    found = [uid for _, uid in found]
+    cached = cache.get_many([FAIR_CACHE_PREFIX + uid for uid in found])
+    missing = [uid for uid in found if FAIR_CACHE_PREFIX + uid not in cached]
+    if missing:
+        rows = list(CoinFlipGame.objects.filter(uid__in=missing).values(*_FIELDS))
+        payloads = _verify_rows(rows) if rows else []
+        fresh = dict((FAIR_CACHE_PREFIX + p['uid'], p) for p in payloads)
+        cache.set_many(fresh, FAIR_CACHE_TIMEOUT)
+        cached.update(fresh)
+    results = [cached[FAIR_CACHE_PREFIX + uid] for uid in found if FAIR_CACHE_PREFIX + uid in cached]
+    mismatches = [r['uid'] for r in results if not r['ok']]
+    return results, mismatches, cursor
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from betting.business.deposit_business import get_tickets
+from betting.models import CoinFlipGame, Deposit, PropItem
+
+
+_logger = logging.getLogger(__name__)
+
+DEPOSIT_BULK_BATCH = getattr(settings, 'DEPOSIT_BULK_BATCH', 200)
+
+
+def _build_item(deposit, steamer, item):
+    return PropItem(
+        sid=steamer.steamid,
+        name=item.get('name', ''),
+        market_name=item.get('market_name', ''),
+        market_hash_name=item.get('market_hash_name', None),
+        amount=item.get('amount', 0.0),
+        rarity=item.get('rarity', None),
+        rarity_color=item.get('rarity_color', None),
+        exterior=item.get('exterior', None),
+        assetid=str(item['assetid']),
+        appid=item.get('appid', 570),
+        classid=item.get('classid', ''),
+        contextid=item.get('contextid', 2),
+        instanceid=item.get('instanceid', None),
+        deposit=deposit
+    )
+
+
+def ingest_deposit_items(deposit, steamer, assetids, inventory):
+    """
+    Adds the items of assetids to the deposit with a constant number of queries.
+
+    inventory is the cached inventory of the steamer as returned by get_user_inventories,
+    every submitted assetid must be in it. Returns (code, result) like join_coinflip_game,
+    result is the list of created PropItem on success. bulk_create sets their pk only on
+    PostgreSQL, on MySQL and SQLite they have none, query them by deposit to get it.
+
+    The queries are one insert per DEPOSIT_BULK_BATCH items, or per the smaller batch
+    the database allows (about 50 rows on SQLite), and three updates.
+    """
+    wanted = list(OrderedDict.fromkeys(str(a) for a in assetids))
+    if not wanted:
+        return 101, 'no items'
+    index = dict((str(i['assetid']), i) for i in inventory)
+    missing = set(wanted).difference(index)
+    if missing:
+        _logger.warning('deposit %s has items not in inventory of %s: %s', deposit.uid, steamer.steamid, sorted(missing))
+        return 102, 'invalid items'
+
+    items = PropItem.prepare_bulk([_build_item(deposit, steamer, index[a]) for a in wanted])
+    amount = sum(i.amount for i in items)
+    # the same ticket rule as join_jackpot_game and join_coinflip_game
+    tickets = get_tickets(amount)
+    if tickets <= 0:
+        return 103, 'deposit value too low'
+    with transaction.atomic():
+        PropItem.objects.bulk_create(items, batch_size=DEPOSIT_BULK_BATCH)
+        deposit_values = {'amount': F('amount') + amount}
+        if deposit.game_id:
+            CoinFlipGame.objects.filter(pk=deposit.game_id).update(
+                total_amount=F('total_amount') + amount,
+                total_items=F('total_items') + len(items),
+                total_tickets=F('total_tickets') + tickets
+            )
+            # the update above holds the row lock, so the range read back is ours
+            total_tickets = CoinFlipGame.objects.filter(pk=deposit.game_id).values_list('total_tickets', flat=True)[0]
+            deposit_values['tickets_begin'] = total_tickets - tickets
+            deposit_values['tickets_end'] = total_tickets - 1
+        Deposit.objects.filter(pk=deposit.pk).update(**deposit_values)
+    deposit.amount += amount
+    if 'tickets_begin' in deposit_values:
+        deposit.tickets_begin = deposit_values['tickets_begin']
+        deposit.tickets_end = deposit_values['tickets_end']
+    return 0, items
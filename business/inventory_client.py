@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from django.conf import settings
+
+
+_logger = logging.getLogger(__name__)
+
+INVENTORY_URL = getattr(settings, 'STEAM_INVENTORY_URL', 'https://steamcommunity.com/inventory/{steamid}/{appid}/{contextid}')
+INVENTORY_APP_CONTEXTS = getattr(settings, 'INVENTORY_APP_CONTEXTS', ((570, 2),))
+INVENTORY_TIMEOUT = getattr(settings, 'INVENTORY_TIMEOUT', (3.05, 10))
+INVENTORY_RETRIES = getattr(settings, 'INVENTORY_RETRIES', 2)
+INVENTORY_PER_HOST = getattr(settings, 'INVENTORY_PER_HOST', 8)
+INVENTORY_WORKERS = getattr(settings, 'INVENTORY_WORKERS', 16)
+INVENTORY_PAGE_SIZE = 5000
+
+
+class InventoryClient(object):
+    """
+    Fetches steam inventories of several appid/contextid pairs concurrently.
+
+    Requests share one pooled session, the number of requests in flight to
+    the same host is limited, failed requests are retried with backoff.
+    """
+
+    def __init__(self, url=INVENTORY_URL, timeout=INVENTORY_TIMEOUT, retries=INVENTORY_RETRIES,
+                 per_host=INVENTORY_PER_HOST, workers=INVENTORY_WORKERS):
+        self.url = url
+        self.timeout = timeout
+        self.per_host = per_host
+        self.workers = workers
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=per_host, pool_maxsize=per_host, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            sem = self._host_limits.get(host, None)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.per_host)
+                self._host_limits[host] = sem
+        return sem
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def fetch_one(self, steamid, appid, contextid, lang='english'):
+        url = self.url.format(steamid=steamid, appid=appid, contextid=contextid)
+        params = {'l': lang, 'count': INVENTORY_PAGE_SIZE}
+        assets = []
+        descriptions = {}
+        sem = self._host_limit(url)
+        while True:
+            with sem:
+                resp = self.session.get(url, params=params, timeout=self.timeout)
+            resp.raise_for_status()
+            body = resp.json() or {}
+            assets.extend(body.get('assets', []))
+            for desc in body.get('descriptions', []):
+                descriptions[(desc.get('classid'), desc.get('instanceid'))] = desc
+            if not body.get('more_items') or not body.get('last_assetid'):
+                break
+            params['start_assetid'] = body['last_assetid']
+        items = []
+        for asset in assets:
+            item = dict(descriptions.get((asset.get('classid'), asset.get('instanceid')), {}))
+            item.update(asset)
+            item['appid'] = appid
+            item['contextid'] = contextid
+            items.append(item)
+        return items
+
+    def _fetch_safe(self, args):
+        steamid, appid, contextid, lang = args
+        begin = time.time()
+        try:
+            return appid, contextid, self.fetch_one(steamid, appid, contextid, lang=lang)
+        except Exception as e:
+            _logger.warning('fetch inventory %s %s/%s failed after %.2fs: %s', steamid, appid, contextid, time.time() - begin, e)
+            return appid, contextid, None
+
+    def fetch_all(self, steamid, app_contexts=INVENTORY_APP_CONTEXTS, lang='english'):
+        """
+        Returns (items, failed), items of all pairs merged in the order of app_contexts,
+        failed is the list of (appid, contextid) which could not be fetched.
+        """
+        tasks = [(steamid, appid, contextid, lang) for appid, contextid in app_contexts]
+        if len(tasks) == 1:
+            results = [self._fetch_safe(tasks[0])]
+        else:
+            results = self._get_pool().map(self._fetch_safe, tasks)
+        items = []
+        failed = []
+        for appid, contextid, ret in results:
+            if ret is None:
+                failed.append((appid, contextid))
+            else:
+                items.extend(ret)
+        return items, failed
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_inventory_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InventoryClient()
+    return _client
+
+
+def fetch_user_inventories(steamid, app_contexts=INVENTORY_APP_CONTEXTS, lang='english'):
+    """
+    The fetch layer of steam_business.get_user_inventories, which keeps its own
+    normalization, pricing and caching of the items. Returns (items, failed),
+    items are the raw steam assets merged with their descriptions and are None
+    only when every pair failed.
+    """
+    if not app_contexts:
+        return [], []
+    items, failed = get_inventory_client().fetch_all(steamid, app_contexts=app_contexts, lang=lang)
+    if len(failed) == len(app_contexts):
+        return None, failed
+    return items, failed
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import io
+import json
+import os
+import logging
+import threading
+from datetime import date
+
+import numpy as np
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, FloatField, IntegerField
+from django.utils import timezone as dt
+
+from betting.models import MarketItem
+
+
+_logger = logging.getLogger(__name__)
+
+PRICE_HISTORY_DIR = getattr(settings, 'PRICE_HISTORY_DIR', os.path.join(getattr(settings, 'BASE_DIR', '.'), 'var', 'price_history'))
+PRICE_HISTORY_EPOCH = getattr(settings, 'PRICE_HISTORY_EPOCH', date(2017, 1, 1))
+PRICE_HISTORY_DAYS = getattr(settings, 'PRICE_HISTORY_DAYS', 8192)
+PRICE_UPDATE_CHUNK = 500
+PRICE_MIN_DAYS_7 = getattr(settings, 'PRICE_MIN_DAYS_7', 5)
+PRICE_MIN_DAYS_30 = getattr(settings, 'PRICE_MIN_DAYS_30', 20)
+
+_ARRAYS = ('price', 'count', 'volume')
+
+
+class PriceHistoryStore(object):
+    """
+    Daily price history of all market items in memory mapped float32 matrices,
+    one row per md5 and one column per day since PRICE_HISTORY_EPOCH.
+
+    price is the mean of the observations of the day, count the number of
+    observations and volume the last observed 24h sold volume. Rows are laid out
+    contiguously, so the history of one item is a view on the file and a window
+    of days for all items is a view as well.
+
+    There is a single writer, the price job. Readers open the files read only and
+    follow the writer by reloading index.json when its mtime changes.
+    """
+
+    def __init__(self, path=PRICE_HISTORY_DIR, epoch=PRICE_HISTORY_EPOCH, days=PRICE_HISTORY_DAYS, readonly=False):
+        self.path = path
+        self.epoch = epoch
+        self.days = days
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._index_file = os.path.join(path, 'index.json')
+        self._index_mtime = None
+        self._dirty = False
+        self._capacity = 0
+        self._arrays = {}
+        self.md5s = []
+        self.rows = {}
+        if not readonly and not os.path.isdir(path):
+            os.makedirs(path)
+        self._load_index()
+        if not readonly:
+            self._open(max(len(self.md5s), 64))
+
+    def _load_index(self):
+        try:
+            mtime = os.path.getmtime(self._index_file)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        with io.open(self._index_file, 'r', encoding='utf-8') as f:
+            self.md5s = json.load(f)
+        self.rows = dict((m, i) for i, m in enumerate(self.md5s))
+        self._index_mtime = mtime
+        if self.readonly:
+            self._open_readonly()
+
+    def _open(self, capacity):
+        for name in _ARRAYS:
+            file_name = os.path.join(self.path, name + '.f4')
+            size = capacity * self.days * 4
+            if not os.path.exists(file_name) or os.path.getsize(file_name) < size:
+                with open(file_name, 'ab') as f:
+                    f.truncate(size)
+            self._arrays[name] = np.memmap(file_name, dtype=np.float32, mode='r+', shape=(capacity, self.days))
+        self._capacity = capacity
+
+    def _open_readonly(self):
+        # the writer grows the files before it writes the index, so they hold every row
+        row_size = self.days * 4
+        capacity = min(os.path.getsize(os.path.join(self.path, name + '.f4')) // row_size for name in _ARRAYS)
+        if capacity == self._capacity:
+            return
+        for name in _ARRAYS:
+            self._arrays[name] = np.memmap(os.path.join(self.path, name + '.f4'), dtype=np.float32, mode='r',
+                                           shape=(capacity, self.days))
+        self._capacity = capacity
+
+    def _save_index(self):
+        tmp = self._index_file + '.tmp'
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(unicode(json.dumps(self.md5s)))
+        os.rename(tmp, self._index_file)
+        self._index_mtime = os.path.getmtime(self._index_file)
+        self._dirty = False
+
+    def _row(self, md5):
+        row = self.rows.get(md5, None)
+        if row is None:
+            row = len(self.md5s)
+            if row >= self._capacity:
+                self._open(self._capacity * 2)
+            self.md5s.append(md5)
+            self.rows[md5] = row
+            self._dirty = True
+        return row
+
+    def column(self, day=None):
+        day = day or dt.localtime(dt.now()).date()
+        col = (day - self.epoch).days
+        if not 0 <= col < self.days:
+            raise ValueError('day {0} is out of the price history range'.format(day))
+        return col
+
+    def append(self, md5, price, volume=None, day=None):
+        if self.readonly:
+            raise ValueError('price history is opened read only')
+        if price is None:
+            return
+        col = self.column(day)
+        with self._lock:
+            row = self._row(md5)
+            count = self._arrays['count']
+            n = count[row, col] + 1
+            mean = self._arrays['price']
+            mean[row, col] += (price - mean[row, col]) / n
+            count[row, col] = n
+            if volume is not None:
+                self._arrays['volume'][row, col] = volume
+
+    def history(self, md5, days=30, day=None):
+        """
+        Returns (price, count, volume) views of the last days ending at day, no data is copied.
+        """
+        if self.readonly:
+            with self._lock:
+                self._load_index()
+        row = self.rows.get(md5, None)
+        if row is None or row >= self._capacity:
+            return None
+        end = self.column(day) + 1
+        begin = max(end - days, 0)
+        return tuple(self._arrays[name][row, begin:end] for name in _ARRAYS)
+
+    def rolling_stats(self, day=None):
+        """
+        Recomputes the averages and volumes of all items at once, returns a dict
+        of arrays aligned with self.md5s. Days without observation are ignored,
+        days_N is the number of observed days of the window.
+        """
+        end = self.column(day) + 1
+        n = len(self.md5s)
+        price = self._arrays['price'][:n]
+        count = self._arrays['count'][:n]
+        volume = self._arrays['volume'][:n]
+        ret = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for days in (7, 30):
+                begin = max(end - days, 0)
+                seen = count[:, begin:end] > 0
+                ret['days_%d' % days] = seen.sum(axis=1)
+                ret['avg_price_%d_days' % days] = np.where(seen, price[:, begin:end], 0).sum(axis=1) / ret['days_%d' % days]
+                ret['sold_%d_days' % days] = np.where(seen, volume[:, begin:end], 0).sum(axis=1)
+        return ret
+
+    def flush(self):
+        for arr in self._arrays.values():
+            arr.flush()
+        if self._dirty:
+            self._save_index()
+
+
+_stores = {}
+_store_lock = threading.Lock()
+
+
+def get_price_store(readonly=True):
+    """
+    The web workers read only, the price job opens the store with readonly=False.
+    """
+    store = _stores.get(readonly, None)
+    if store is None:
+        with _store_lock:
+            store = _stores.get(readonly, None)
+            if store is None:
+                store = _stores[readonly] = PriceHistoryStore(readonly=readonly)
+    return store
+
+
+def record_market_prices(store=None, day=None):
+    """
+    Appends the current price and 24h volume of every market item as one observation.
+    """
+    store = store or get_price_store(readonly=False)
+    count = 0
+    for md5, price, sold in MarketItem.objects.order_by().values_list('md5', 'current_price', 'sold_last_24h').iterator():
+        store.append(md5, price, volume=sold, day=day)
+        count += 1
+    store.flush()
+    return count
+
+
+def _case(values, output_field):
+    return Case(*[When(md5=md5, then=Value(v)) for md5, v in values], output_field=output_field)
+
+
+def update_market_item_stats(store=None, day=None):
+    """
+    Writes the stats recomputed from our own samples to the history_* fields of
+    MarketItem, one update query per chunk. The upstream avg_price_* and sold_*
+    fields are left alone. A window with less than PRICE_MIN_DAYS_N observed
+    days is written as NULL.
+    """
+    store = store or get_price_store(readonly=False)
+    stats = store.rolling_stats(day=day)
+    fields = (
+        ('history_avg_7_days', 'avg_price_7_days', 7, FloatField()),
+        ('history_avg_30_days', 'avg_price_30_days', 30, FloatField()),
+        ('history_sold_7_days', 'sold_7_days', 7, IntegerField()),
+    )
+    min_days = {7: PRICE_MIN_DAYS_7, 30: PRICE_MIN_DAYS_30}
+    md5s = store.md5s
+    for begin in range(0, len(md5s), PRICE_UPDATE_CHUNK):
+        end = begin + PRICE_UPDATE_CHUNK
+        chunk = md5s[begin:end]
+        values = {'history_days_30': _case([(m, int(v)) for m, v in zip(chunk, stats['days_30'][begin:end])], IntegerField())}
+        for field, name, days, output_field in fields:
+            covered = stats['days_%d' % days][begin:end] >= min_days[days]
+            convert = float if isinstance(output_field, FloatField) else int
+            values[field] = _case([(m, convert(round(v, 2)) if ok else None)
+                                   for m, v, ok in zip(chunk, stats[name][begin:end], covered)], output_field)
+        with transaction.atomic():
+            MarketItem.objects.filter(md5__in=chunk).update(**values)
+    return len(md5s)
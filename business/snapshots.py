@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from betting.models import SiteConfig, MAINTENANCE_KEY
+
+
+_logger = logging.getLogger(__name__)
+
+CONFIG_SNAPSHOT_TTL = getattr(settings, 'CONFIG_SNAPSHOT_TTL', 60)
+
+# Loaded by the warmup in the master process before fork, so the workers share
+# it copy-on-write until the first refresh.
+_config_snapshot = [None, 0]
+_lock = threading.Lock()
+
+
+def load_config_snapshot():
+    snapshot = dict((c.key, c) for c in SiteConfig.objects.filter(enable=True))
+    with _lock:
+        _config_snapshot[0], _config_snapshot[1] = snapshot, time.time()
+    return snapshot
+
+
+def get_site_config(key):
+    """
+    Enabled SiteConfig of the key or None, refreshed every CONFIG_SNAPSHOT_TTL.
+    """
+    snapshot, loaded_at = _config_snapshot
+    if snapshot is None or time.time() - loaded_at > CONFIG_SNAPSHOT_TTL:
+        snapshot = load_config_snapshot()
+    return snapshot.get(key, None)
+
+
+def get_maintenance():
+    """
+    Value of the enabled maintenance config, 0 when there is none. Read from the
+    snapshot, so switching maintenance on takes up to CONFIG_SNAPSHOT_TTL.
+    """
+    config = get_site_config(MAINTENANCE_KEY)
+    return config.value if config else 0
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone as dt
+
+from betting.common_data import TradeStatus
+from betting.models import CoinFlipGame, Deposit, UserAmountRecord, SiteConfig, STAT_REBUILD_KEY
+from betting.models import UserDailyStat, UserStatTotal, UserDailyStatStaging, UserStatTotalStaging
+
+
+_logger = logging.getLogger(__name__)
+
+STAT_BACKFILL_CHUNK = 500
+
+_STAT_COLUMNS = ('games', 'wins', 'staked', 'payout')
+
+
+def _local_date(ts):
+    # aware under USE_TZ = True, naive local time otherwise
+    return dt.localtime(ts).date() if dt.is_aware(ts) else ts.date()
+
+
+def _stat_date(game):
+    return _local_date(game.win_ts or game.update_time)
+
+
+def _collect_games_stats(games):
+    """
+    Returns {(steamer_id, date): [games, wins, staked, payout]} of ended games.
+
+    The stake is the accepted deposits of the steamer, the profit is the amount of
+    UserAmountRecord of the game, so payout = stake + profit. A participant without
+    profit record lost the stake.
+    """
+    game_ids = [g.id for g in games]
+    stakes = defaultdict(float)
+    for game_id, steamer_id, amount in Deposit.objects.filter(
+            game_id__in=game_ids, status=TradeStatus.Accepted.value).order_by().values_list('game_id', 'steamer_id', 'amount'):
+        stakes[(game_id, steamer_id)] += amount
+    profits = {}
+    for game_id, steamer_id, amount in UserAmountRecord.objects.filter(
+            game_id__in=game_ids).order_by().values_list('game_id', 'steamer_id', 'amount'):
+        profits[(game_id, steamer_id)] = profits.get((game_id, steamer_id), 0.0) + amount
+    dates = dict((g.id, _stat_date(g)) for g in games)
+    stats = defaultdict(lambda: [0, 0, 0.0, 0.0])
+    for key in set(stakes) | set(profits):
+        game_id, steamer_id = key
+        stake = stakes.get(key, 0.0)
+        profit = profits.get(key, -stake)
+        s = stats[(steamer_id, dates[game_id])]
+        s[0] += 1
+        s[1] += 1 if profit > 0 else 0
+        s[2] += stake
+        s[3] += stake + profit
+    return stats
+
+
+def _upsert(model, lookup, games, wins, staked, payout):
+    values = {
+        'games': F('games') + games,
+        'wins': F('wins') + wins,
+        'staked': F('staked') + staked,
+        'payout': F('payout') + payout
+    }
+    if model.objects.filter(**lookup).update(**values):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(games=games, wins=wins, staked=staked, payout=payout, **lookup)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(**values)
+
+
+def _apply_stats(day_stats, daily_model=UserDailyStat, total_model=UserStatTotal):
+    totals = defaultdict(lambda: [0, 0, 0.0, 0.0])
+    for (steamer_id, date), s in day_stats.items():
+        _upsert(daily_model, {'steamer_id': steamer_id, 'date': date}, *s)
+        t = totals[steamer_id]
+        for i in range(4):
+            t[i] += s[i]
+    for steamer_id, t in totals.items():
+        _upsert(total_model, {'steamer_id': steamer_id}, *t)
+
+
+def is_rebuilding():
+    return SiteConfig.objects.filter(key=STAT_REBUILD_KEY, value=1).exists()
+
+
+def _set_rebuilding(value):
+    SiteConfig.objects.update_or_create(key=STAT_REBUILD_KEY, defaults={
+        'value': value, 'value_string': '', 'remark': 'user stats rebuilding'})
+
+
+def update_stats_on_settlement(game_id):
+    """
+    Adds an ended game to the stats of every participant, called on commit of the
+    profit record of the winner, so the profits are complete when they are read.
+    stat_counted guards against counting a game twice. While a rebuild runs the
+    game is left for the rebuild catch up.
+    """
+    try:
+        if is_rebuilding():
+            return False
+        with transaction.atomic():
+            if not CoinFlipGame.objects.filter(pk=game_id, end=1, stat_counted=False).update(stat_counted=True):
+                return False
+            game = CoinFlipGame.objects.only('id', 'win_ts', 'update_time').get(pk=game_id)
+            _apply_stats(_collect_games_stats([game]))
+        return True
+    except Exception as e:
+        _logger.exception(e)
+        return False
+
+
+def count_missing_games(chunk=STAT_BACKFILL_CHUNK):
+    """
+    Counts the ended games which were not counted yet, e.g. settled by a queryset
+    update or bulk_create which does not send post_save, or during a rebuild.
+    """
+    count = 0
+    last_id = 0
+    while True:
+        ids = list(CoinFlipGame.objects.filter(id__gt=last_id, end=1, stat_counted=False).order_by('id').values_list(
+            'id', flat=True)[:chunk])
+        if not ids:
+            break
+        last_id = ids[-1]
+        for game_id in ids:
+            if update_stats_on_settlement(game_id):
+                count += 1
+    return count
+
+
+def _format_wins(times, wins, cost, payout):
+    wpct = round(wins * 100.0 / times, 2) if times else 0
+    return times, wpct, round(cost, 2), round(payout - cost, 2)
+
+
+def getWins(steamer, days=0):
+    """
+    Returns (times, win percentage, cost, income) of the steamer in the last days,
+    days <= 0 means all the time.
+    """
+    if days and days > 0:
+        since = _local_date(dt.now()) - timedelta(days=days - 1)
+        agg = UserDailyStat.objects.filter(steamer=steamer, date__gte=since).aggregate(
+            games=Sum('games'), wins=Sum('wins'), staked=Sum('staked'), payout=Sum('payout'))
+        times, wins, cost, payout = agg['games'] or 0, agg['wins'] or 0, agg['staked'] or 0.0, agg['payout'] or 0.0
+    else:
+        total = UserStatTotal.objects.filter(steamer=steamer).first()
+        if total is None:
+            return 0, 0, 0.0, 0.0
+        times, wins, cost, payout = total.games, total.wins, total.staked, total.payout
+    return _format_wins(times, wins, cost, payout)
+
+
+def get_users_wins(days=0):
+    """
+    Returns {steamer_id: (times, win percentage, cost, income)} of every active
+    steamer with stats in one grouped query, the numbers are those of getWins.
+    """
+    if days and days > 0:
+        since = _local_date(dt.now()) - timedelta(days=days - 1)
+        rows = UserDailyStat.objects.filter(steamer__is_active=True, date__gte=since).order_by().values(
+            'steamer').annotate(games=Sum('games'), wins=Sum('wins'), staked=Sum('staked'), payout=Sum('payout'))
+        rows = ((r['steamer'], r['games'], r['wins'], r['staked'], r['payout']) for r in rows)
+    else:
+        rows = UserStatTotal.objects.filter(steamer__is_active=True).order_by().values_list(
+            'steamer_id', 'games', 'wins', 'staked', 'payout')
+    return dict((r[0], _format_wins(*r[1:])) for r in rows)
+
+
+def _swap_staging():
+    columns = ', '.join(_STAT_COLUMNS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        UserDailyStat.objects.all().delete()
+        UserStatTotal.objects.all().delete()
+        cursor.execute('INSERT INTO {0} (steamer_id, date, {1}) SELECT steamer_id, date, {1} FROM {2}'.format(
+            UserDailyStat._meta.db_table, columns, UserDailyStatStaging._meta.db_table))
+        cursor.execute('INSERT INTO {0} (steamer_id, {1}) SELECT steamer_id, {1} FROM {2}'.format(
+            UserStatTotal._meta.db_table, columns, UserStatTotalStaging._meta.db_table))
+
+
+def rebuild_user_stats(chunk=STAT_BACKFILL_CHUNK):
+    """
+    Rebuilds the stats from the ended games into the staging tables and swaps them
+    in with one transaction, readers keep seeing the old stats until then.
+
+    The games are walked in keyset chunks on id, every chunk counts its ended games
+    into the staging tables and sets stat_counted of the chunk in the same
+    transaction. Settlement does not count games while the rebuild flag is set, so
+    the games ended behind the walk are still uncounted afterwards and are added by
+    the catch up. If a rebuild fails, run it again.
+    """
+    _set_rebuilding(1)
+    try:
+        UserDailyStatStaging.objects.all().delete()
+        UserStatTotalStaging.objects.all().delete()
+        last_id = 0
+        count = 0
+        while True:
+            games = list(CoinFlipGame.objects.filter(id__gt=last_id).order_by('id').only(
+                'id', 'end', 'win_ts', 'update_time')[:chunk])
+            if not games:
+                break
+            last_id = games[-1].id
+            ended = [g for g in games if g.end == 1]
+            others = [g.id for g in games if g.end != 1]
+            with transaction.atomic():
+                if ended:
+                    _apply_stats(_collect_games_stats(ended), UserDailyStatStaging, UserStatTotalStaging)
+                    CoinFlipGame.objects.filter(id__in=[g.id for g in ended]).update(stat_counted=True)
+                if others:
+                    CoinFlipGame.objects.filter(id__in=others, stat_counted=True).update(stat_counted=False)
+            count += len(ended)
+            _logger.info('rebuild user stats, %s games done', count)
+        _swap_staging()
+    finally:
+        _set_rebuilding(0)
+    count += count_missing_games(chunk=chunk)
+    return count
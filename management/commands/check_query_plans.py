@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from betting.common_data import TradeStatus
+from betting.models import Announcement, GiveAway, SendRecord, Deposit, CoinFlipGame, TempGameHash
+
+
+# name, the queryset as the app runs it (default Meta.ordering and the pk ordering
+# of first() included), the columns it compares with equality and the columns of
+# the index it must be served by.
+HOT_QUERIES = (
+    ('announcement', lambda: Announcement.objects.filter(anno_type=0, enable=True).order_by('num')[:1],
+     ('anno_type', 'enable'), ('anno_type', 'enable', 'num')),
+    ('giveaway', lambda: GiveAway.objects.filter(enable=True).order_by('num')[:1],
+     ('enable',), ('enable', 'num')),
+    ('send_record', lambda: SendRecord.objects.filter(steamer_id=1, status=TradeStatus.Initialed.value).order_by('pk')[:1],
+     ('steamer_id', 'status'), ('steamer_id', 'status', 'id')),
+    ('deposit_status', lambda: Deposit.objects.filter(steamer_id=1, status=TradeStatus.Accepted.value),
+     ('steamer_id', 'status'), ('steamer_id', 'status', 'create_time')),
+    ('deposit_tickets', lambda: Deposit.objects.filter(game_id=1).order_by('tickets_begin'),
+     ('game_id',), ('game_id', 'tickets_begin')),
+    ('game_status', lambda: CoinFlipGame.objects.filter(status=2, game_type=0),
+     ('status', 'game_type'), ('status', 'game_type', 'create_time')),
+    ('temp_hash', lambda: TempGameHash.objects.filter(used=0).order_by('pk')[:1],
+     ('used',), ('used', 'id')),
+)
+
+_PG_SORT = re.compile(r'^(->\s+)?(Incremental )?Sort\s')
+
+
+def _index_names(cursor, model, columns):
+    constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return [name for name, c in constraints.items() if c['index'] and list(c['columns']) == list(columns)]
+
+
+def _check_postgresql(cursor, sql, params, eq_columns, names):
+    # make the planner pick an index whenever one exists, small seeded tables
+    # would be scanned sequentially otherwise
+    cursor.execute('SET LOCAL enable_seqscan = off')
+    cursor.execute('SET LOCAL enable_sort = off')
+    cursor.execute('EXPLAIN ' + sql, params)
+    lines = [r[0].strip() for r in cursor.fetchall()]
+    problems = []
+    if any('Seq Scan' in line for line in lines):
+        problems.append('sequential scan')
+    if any(_PG_SORT.match(line) for line in lines):
+        problems.append('sort')
+    for line in lines:
+        if line.startswith('Filter:'):
+            problems.extend('{0} filtered outside the index'.format(c) for c in eq_columns if c in line)
+    if not any(re.search(r'\b(using|on) {0}\b'.format(re.escape(n)), line) for line in lines for n in names):
+        problems.append('not served by {0}'.format(', '.join(names)))
+    return '\n'.join(lines), problems
+
+
+def _check_mysql(cursor, sql, params, eq_columns, names):
+    cursor.execute('EXPLAIN ' + sql, params)
+    cols = [c[0] for c in cursor.description]
+    rows = [dict(zip(cols, r)) for r in cursor.fetchall()]
+    problems = []
+    for r in rows:
+        extra = r.get('Extra') or ''
+        if 'no matching row' in extra or 'Impossible WHERE' in extra or 'no matching min/max row' in extra:
+            # the optimizer read the table instead of planning, the plan says nothing
+            problems.append('no rows to plan, seed the table first')
+            continue
+        if r.get('type') in ('ALL', 'index'):
+            problems.append('full {0} scan'.format('table' if r.get('type') == 'ALL' else 'index'))
+        if 'filesort' in extra:
+            problems.append('filesort')
+        if r.get('key') not in names:
+            problems.append('key {0} is not {1}'.format(r.get('key'), ', '.join(names)))
+    return '\n'.join(str(r) for r in rows), problems
+
+
+def _check_sqlite(cursor, sql, params, eq_columns, names):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    lines = [r[-1] for r in cursor.fetchall()]
+    problems = []
+    if any('TEMP B-TREE' in line for line in lines):
+        problems.append('sort')
+    used = [line for line in lines if any(re.search(r'\bINDEX {0}\b'.format(re.escape(n)), line) for n in names)]
+    if not used:
+        problems.append('not served by {0}'.format(', '.join(names)))
+    else:
+        problems.extend('{0} filtered outside the index'.format(c) for c in eq_columns
+                        if not any('{0}=?'.format(c) in line for line in used))
+    return '\n'.join(lines), problems
+
+
+_CHECKS = {
+    'postgresql': _check_postgresql,
+    'mysql': _check_mysql,
+    'sqlite': _check_sqlite,
+}
+
+
+def explain_query(queryset, eq_columns, index_columns):
+    """
+    Returns (plan, problems) of the queryset, problems is empty when the filter and
+    the order are both served by the index on index_columns.
+    """
+    check = _CHECKS.get(connection.vendor, None)
+    if check is None:
+        raise CommandError('Unsupported database vendor: {0}'.format(connection.vendor))
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        names = _index_names(cursor, queryset.model, index_columns)
+        if not names:
+            return '', ['no index on ({0})'.format(', '.join(index_columns))]
+        return check(cursor, sql, params, eq_columns, names)
+
+
+class Command(BaseCommand):
+    help = 'Explain the hot queries and fail if any of them is not served by its index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        failed = []
+        for name, build, eq_columns, index_columns in HOT_QUERIES:
+            plan, problems = explain_query(build(), eq_columns, index_columns)
+            if problems:
+                failed.append(name)
+            if problems or options['verbose_plans']:
+                self.stdout.write('[{0}] {1} {2}\n{3}\n'.format(
+                    'FAIL' if problems else 'OK', name, '; '.join(problems), plan))
+        if failed:
+            raise CommandError('Queries not served by their index: {0}'.format(', '.join(failed)))
+        self.stdout.write('All {0} hot queries use their indexes.'.format(len(HOT_QUERIES)))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from betting.business.export_business import EXPORT_MODELS, EXPORT_FORMATS, EXPORT_CHUNK
+from betting.business.export_business import iter_export_lines, parse_export_date
+
+
+class Command(BaseCommand):
+    help = 'Export games, deposits, items, send records or amount records as csv or jsonl.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=sorted(EXPORT_MODELS.keys()))
+        parser.add_argument('output')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', default=None, help='YYYY-MM-DD, included')
+        parser.add_argument('--end', default=None, help='YYYY-MM-DD, excluded')
+        parser.add_argument('--game-type', type=int, default=None)
+        parser.add_argument('--chunk', type=int, default=EXPORT_CHUNK)
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_export_date(options['start'])
+            end = parse_export_date(options['end'])
+        except ValueError as e:
+            raise CommandError(e)
+        count = 0
+        with io.open(options['output'], 'wb') as f:
+            for line in iter_export_lines(options['target'], fmt=options['format'], start=start, end=end,
+                                          game_type=options['game_type'], chunk=options['chunk']):
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                f.write(line)
+                count += 1
+        self.stdout.write('Exported {0} lines to {1}.'.format(count, options['output']))
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from betting.business.chat_business import prune_messages, CHAT_RETENTION_DAYS, CHAT_PRUNE_CHUNK
+
+
+class Command(BaseCommand):
+    help = 'Delete chat messages older than the retention days in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=CHAT_RETENTION_DAYS)
+        parser.add_argument('--chunk', type=int, default=CHAT_PRUNE_CHUNK)
+
+    def handle(self, *args, **options):
+        total = prune_messages(days=options['days'], chunk=options['chunk'])
+        self.stdout.write('Pruned {0} messages.'.format(total))
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from betting.business.stat_business import rebuild_user_stats, count_missing_games, STAT_BACKFILL_CHUNK
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily and total user stats from the ended games.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=STAT_BACKFILL_CHUNK)
+        parser.add_argument('--catch-up', action='store_true', default=False,
+                            help='Only count the ended games which are not counted yet.')
+
+    def handle(self, *args, **options):
+        if options['catch_up']:
+            count = count_missing_games(chunk=options['chunk'])
+            self.stdout.write('Counted {0} missing games.'.format(count))
+            return
+        count = rebuild_user_stats(chunk=options['chunk'])
+        self.stdout.write('Rebuilt stats of {0} games.'.format(count))
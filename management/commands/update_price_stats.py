@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from django.core.management.base import BaseCommand
+
+from betting.business.price_history import get_price_store, record_market_prices, update_market_item_stats
+
+
+class Command(BaseCommand):
+    help = 'Append the current market prices to the price history and recompute the market item stats.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-record', action='store_true', default=False,
+                            help='Only recompute the stats from the stored history.')
+
+    def handle(self, *args, **options):
+        store = get_price_store(readonly=False)
+        if not options['no_record']:
+            count = record_market_prices(store)
+            self.stdout.write('Recorded {0} prices.'.format(count))
+        count = update_market_item_stats(store)
+        self.stdout.write('Updated stats of {0} items.'.format(count))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+
+from django.contrib.auth.middleware import get_user
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+
+_logger = logging.getLogger(__name__)
+
+
+def get_request_user(request):
+    """
+    The logged in SteamUser of the request, loaded by the backend's get_user with
+    django's session checks. The result is cached on the request and shared with
+    AuthenticationMiddleware, so a request runs one user query however often it
+    asks.
+    """
+    return get_user(request)
+
+
+class SteamUserMiddleware(MiddlewareMixin):
+    """
+    Sets request.user to get_request_user, must be placed after AuthenticationMiddleware.
+    """
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: get_request_user(request))
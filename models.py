@@ -13,7 +13,9 @@ from betting.common_data import TradeStatus, JoinStatus
 
 from django.utils import timezone as dt
 from django.utils.translation import ugettext as _l, ugettext_lazy as _
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.db.models.fields.related import ManyToManyField
 from django.db.models.fields.files import FieldFile
 from django.contrib.auth.models import User
@@ -58,6 +60,18 @@ class ModelBase(models.Model):
         self.update_time = dt.now()
         super(ModelBase, self).save(*args, **kwargs)
 
+    @classmethod
+    def prepare_bulk(cls, objs):
+        # bulk_create does not call save, fill uid and timestamps for all rows at once
+        now = dt.now()
+        for obj in objs:
+            if not obj.uid:
+                obj.uid = uuid1().hex
+            if not obj.create_time:
+                obj.create_time = now
+            obj.update_time = now
+        return objs
+
     def to_dict(self, completed=False):
         opts = self._meta
         data = {}
@@ -110,6 +124,7 @@ class Message(models.Model):
     #     return {'handle': self.handle, 'message': self.message, 'timestamp': self.formatted_timestamp}
 
     class Meta:
+        index_together = (('room', 'timestamp'),)
         verbose_name = _("聊天信息")
         verbose_name_plural = _("聊天信息")
 
@@ -121,6 +136,8 @@ class TempGameHash(models.Model):
     used = models.SmallIntegerField(default=0)
 
     class Meta:
+        # the next unused hash is taken in pk order
+        index_together = (('used', 'id'),)
         verbose_name = _("Temp Game Hash")
         verbose_name_plural = _("Temp Game Hash")
 
@@ -149,9 +166,11 @@ class CoinFlipGame(ModelBase):
     win_ts = models.DateTimeField(default=dt.now, verbose_name=_("Win at"))
     status = models.SmallIntegerField(default=0, verbose_name=_("Status"), choices=GAME_STATUS)
     end = models.SmallIntegerField(default=0, verbose_name=_("Is End"), choices=GAME_END_STATUS)
+    stat_counted = models.BooleanField(default=False, db_index=True, verbose_name=_("Stat Counted"))
 
     class Meta:
         ordering = ('-create_time',)
+        index_together = (('status', 'game_type', 'create_time'),)
         verbose_name = _('Games')
         verbose_name_plural = _('Games')
 
@@ -188,6 +207,7 @@ class Deposit(ModelBase):
 
     class Meta:
         ordering = ('create_time',)
+        index_together = (('steamer', 'status', 'create_time'), ('game', 'tickets_begin'))
         verbose_name = _('Deposit')
         verbose_name_plural = _('Deposit')
 
@@ -210,6 +230,8 @@ class SendRecord(ModelBase):
         return self.uid
 
     class Meta:
+        # first() orders by pk, the index serves the order as well
+        index_together = (('steamer', 'status', 'id'),)
         verbose_name = _('Send Records')
         verbose_name_plural = _('Send Records')
 
@@ -263,11 +285,13 @@ class Announcement(ModelBase):
         return self.remark
 
     class Meta:
+        index_together = (('anno_type', 'enable', 'num'),)
         verbose_name = _("Announcements")
         verbose_name_plural = _("Announcements")
 
 
 MAINTENANCE_KEY = 'maintenance'
+STAT_REBUILD_KEY = 'stat_rebuilding'
 
 
 class SiteConfig(models.Model):
@@ -327,6 +351,11 @@ class MarketItem(models.Model):
     sold_last_7d = models.IntegerField(default=0, null=True)
     avg_daily_volume = models.IntegerField(default=0, null=True)
     img = models.URLField(null=True, max_length=1024)
+    # recomputed from the local price history, NULL until the window is covered
+    history_avg_7_days = models.FloatField(null=True)
+    history_avg_30_days = models.FloatField(null=True)
+    history_sold_7_days = models.IntegerField(null=True)
+    history_days_30 = models.IntegerField(default=0)
 
 
 class SteamrobotApiItem(models.Model):
@@ -365,6 +394,52 @@ class UserAmountRecord(ModelBase):
         verbose_name_plural = _('UserAmountReocrds')
 
 
+class UserDailyStat(models.Model):
+    steamer = models.ForeignKey(SteamUser, related_name='daily_stats', verbose_name=_('Steamer'))
+    date = models.DateField(verbose_name=_('Date'))
+    games = models.IntegerField(default=0, verbose_name=_('Games'))
+    wins = models.IntegerField(default=0, verbose_name=_('Wins'))
+    staked = models.FloatField(default=0.0, verbose_name=_('Staked'))
+    payout = models.FloatField(default=0.0, verbose_name=_('Payout'))
+
+    class Meta:
+        unique_together = (('steamer', 'date'),)
+        verbose_name = _('User Daily Stats')
+        verbose_name_plural = _('User Daily Stats')
+
+
+class UserStatTotal(models.Model):
+    steamer = models.OneToOneField(SteamUser, related_name='stat_total', verbose_name=_('Steamer'))
+    games = models.IntegerField(default=0, verbose_name=_('Games'))
+    wins = models.IntegerField(default=0, verbose_name=_('Wins'))
+    staked = models.FloatField(default=0.0, verbose_name=_('Staked'))
+    payout = models.FloatField(default=0.0, verbose_name=_('Payout'))
+
+    class Meta:
+        verbose_name = _('User Total Stats')
+        verbose_name_plural = _('User Total Stats')
+
+
+class UserDailyStatStaging(models.Model):
+    steamer_id = models.IntegerField()
+    date = models.DateField()
+    games = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    staked = models.FloatField(default=0.0)
+    payout = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = (('steamer_id', 'date'),)
+
+
+class UserStatTotalStaging(models.Model):
+    steamer_id = models.IntegerField(unique=True)
+    games = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    staked = models.FloatField(default=0.0)
+    payout = models.FloatField(default=0.0)
+
+
 class GiveAway(ModelBase):
     title = models.CharField(max_length=128, verbose_name=_("Title"))
     img = models.URLField(verbose_name=_("Img Url"))
@@ -378,6 +453,7 @@ class GiveAway(ModelBase):
         return self.remark
 
     class Meta:
+        index_together = (('enable', 'num'),)
         verbose_name = _("Give Away")
         verbose_name_plural = _("Give Away")
 
@@ -392,3 +468,13 @@ class Promotion(models.Model):
     class Meta:
         verbose_name = _('Promotion')
         verbose_name_plural = _('Promotion')
+
+
+@receiver(post_save, sender=UserAmountRecord)
+def count_settled_game(sender, instance, created, **kwargs):
+    # settlement writes the profit record of the winner after the game is ended,
+    # counting on end would see the winner without profit and count a loss
+    if created and instance.amount > 0:
+        from betting.business.stat_business import update_stats_on_settlement
+        game_id = instance.game_id
+        transaction.on_commit(lambda: update_stats_on_settlement(game_id))
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from social_auth.models import SteamUser
+
+
+def make_steamers(count, start=0):
+    return [SteamUser.objects.create(steamid=str(76561198000000000 + start + i)) for i in range(count)]
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from betting.business.deposit_business import make_game_hash, get_win_ticket
+from betting.business.fair_business import win_tickets, _verify_rows
+
+
+class WinTicketsTest(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(20170101)
+        self.percentage = [float(p) for p in rng.random_sample(2000)] + [0.0, 0.5, 0.999999999999]
+        self.tickets = [int(t) for t in rng.randint(1, 10 ** 9, size=2000)] + [1, 3, 10 ** 12]
+
+    def test_matches_get_win_ticket(self):
+        expected = [get_win_ticket(p, t) for p, t in zip(self.percentage, self.tickets)]
+        self.assertEqual(win_tickets(self.percentage, self.tickets).tolist(), expected)
+
+    def test_verify_rows(self):
+        rows = []
+        for i, (p, t) in enumerate(zip(self.percentage[:3], self.tickets[:3])):
+            rows.append({
+                'uid': 'game{0}'.format(i),
+                'hash': make_game_hash('secret{0}'.format(i), p),
+                'secret': 'secret{0}'.format(i),
+                'percentage': p,
+                'total_tickets': t,
+                'win_ticket': get_win_ticket(p, t)
+            })
+        rows[1]['win_ticket'] += 1
+        rows[2]['hash'] = 'forged'
+        ret = _verify_rows(rows)
+        self.assertEqual([r['ok'] for r in ret], [True, False, False])
+        self.assertEqual([r['ticket_ok'] for r in ret], [True, False, True])
+        self.assertEqual([r['hash_ok'] for r in ret], [True, True, False])
+        self.assertEqual(ret[1]['expected_ticket'], get_win_ticket(rows[1]['percentage'], rows[1]['total_tickets']))
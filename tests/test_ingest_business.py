@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from django.db import connection
+from django.test import TestCase
+
+from betting.business.ingest_business import ingest_deposit_items, DEPOSIT_BULK_BATCH
+from betting.models import CoinFlipGame, Deposit, PropItem
+from betting.tests.factories import make_steamers
+
+
+def _inventory(count):
+    return [{
+        'assetid': str(1000 + i),
+        'name': 'Item {0}'.format(i),
+        'market_name': 'Item {0}'.format(i),
+        'market_hash_name': 'Item {0}'.format(i),
+        'amount': 1.0,
+        'classid': str(i),
+        'appid': 570,
+        'contextid': 2
+    } for i in range(count)]
+
+
+class IngestDepositItemsTest(TestCase):
+
+    def setUp(self):
+        self.steamer = make_steamers(1)[0]
+        self.game = CoinFlipGame.objects.create(hash='h', secret='s')
+        self.deposit = Deposit.objects.create(steamer=self.steamer, game=self.game)
+
+    def _expected_queries(self, count):
+        # the fields bulk_create inserts, the auto pk is left out
+        fields = [f for f in PropItem._meta.concrete_fields if not f.primary_key]
+        batch = min(DEPOSIT_BULK_BATCH, connection.ops.bulk_batch_size(fields, [None] * count) or count)
+        inserts = (count + batch - 1) // batch
+        # savepoint and its release, inserts, game update, ticket read back, deposit update
+        return 2 + inserts + 3
+
+    def _ingest(self, count):
+        inventory = _inventory(count)
+        with self.assertNumQueries(self._expected_queries(count)):
+            code, items = ingest_deposit_items(self.deposit, self.steamer, [i['assetid'] for i in inventory], inventory)
+        self.assertEqual(code, 0)
+        self.assertEqual(len(items), count)
+        self.assertEqual(PropItem.objects.filter(deposit=self.deposit).count(), count)
+        self.assertEqual(Deposit.objects.get(pk=self.deposit.pk).amount, float(count))
+
+    def test_one_item(self):
+        self._ingest(1)
+
+    def test_hundred_items(self):
+        self._ingest(100)
+
+    def test_unknown_item_writes_nothing(self):
+        with self.assertNumQueries(0):
+            code, _ = ingest_deposit_items(self.deposit, self.steamer, ['1', '2'], _inventory(1))
+        self.assertEqual(code, 102)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+import re
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+
+from django.test import SimpleTestCase
+
+from betting.business.inventory_client import InventoryClient
+
+
+FAKE_DELAY = 0.3
+
+FAKE_INVENTORIES = {
+    # (appid, contextid): pages
+    ('570', '2'): [
+        {
+            'assets': [{'assetid': '1', 'classid': '10', 'instanceid': '0'}],
+            'descriptions': [{'classid': '10', 'instanceid': '0', 'market_hash_name': 'Dota Item',
+                              'tags': [{'category': 'Rarity', 'localized_tag_name': 'Rare', 'color': '4b69ff'}]}],
+            'more_items': 1,
+            'last_assetid': '1'
+        },
+        {
+            'assets': [{'assetid': '2', 'classid': '11', 'instanceid': '0'}],
+            'descriptions': [{'classid': '11', 'instanceid': '0', 'market_hash_name': 'Other Item'}]
+        }
+    ],
+    ('730', '2'): [
+        {
+            'assets': [{'assetid': '3', 'classid': '20', 'instanceid': '0'}],
+            'descriptions': [{'classid': '20', 'instanceid': '0', 'market_hash_name': 'CS Item',
+                              'tags': [{'category': 'Exterior', 'localized_tag_name': 'Field-Tested'}]}]
+        }
+    ]
+}
+
+
+class FakeInventoryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = re.match(r'^/inventory/(\d+)/(\d+)/(\d+)$', url.path)
+        if not match:
+            self.send_error(404)
+            return
+        time.sleep(FAKE_DELAY)
+        pages = FAKE_INVENTORIES.get((match.group(2), match.group(3)), None)
+        if pages is None:
+            self.send_error(500)
+            return
+        start = parse_qs(url.query).get('start_assetid', [None])[0]
+        page = pages[1] if start else pages[0]
+        body = json.dumps(page)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeInventoryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class InventoryClientTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(InventoryClientTest, cls).setUpClass()
+        cls.server = FakeInventoryServer(('127.0.0.1', 0), FakeInventoryHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        url = 'http://127.0.0.1:{0}/inventory/{{steamid}}/{{appid}}/{{contextid}}'.format(cls.server.server_address[1])
+        cls.client = InventoryClient(url=url, timeout=(1, 2), retries=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(InventoryClientTest, cls).tearDownClass()
+
+    def test_fetch_all_merges_pages_and_contexts(self):
+        items, failed = self.client.fetch_all('76561198000000000', app_contexts=((570, 2), (730, 2)))
+        self.assertEqual(failed, [])
+        self.assertEqual([i['assetid'] for i in items], ['1', '2', '3'])
+        self.assertEqual(items[0]['market_hash_name'], 'Dota Item')
+        self.assertEqual(items[2]['appid'], 730)
+
+    def test_fetch_all_is_concurrent(self):
+        begin = time.time()
+        self.client.fetch_all('76561198000000000', app_contexts=((730, 2), (730, 2), (730, 2)))
+        self.assertLess(time.time() - begin, FAKE_DELAY * 2.5)
+
+    def test_failed_context_is_reported(self):
+        items, failed = self.client.fetch_all('76561198000000000', app_contexts=((730, 2), (440, 2)))
+        self.assertEqual([i['assetid'] for i in items], ['3'])
+        self.assertEqual(failed, [(440, 2)])
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+from django.test import TestCase
+
+from betting.business.price_history import PriceHistoryStore, update_market_item_stats
+from betting.models import MarketItem
+
+
+EPOCH = date(2017, 1, 1)
+DAY = date(2017, 3, 1)
+
+
+class PriceHistoryTest(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = PriceHistoryStore(path=self.path, epoch=EPOCH, days=128)
+        # 'full' is seen every day of the last week, twice on the last day
+        for i in range(7):
+            self.store.append('full', 10.0, volume=2, day=DAY - timedelta(days=i))
+        self.store.append('full', 12.0, volume=3, day=DAY)
+        # 'gaps' is seen 3 days of the last week and twice before the month
+        for i, price in ((0, 4.0), (2, 6.0), (5, 8.0)):
+            self.store.append('gaps', price, volume=1, day=DAY - timedelta(days=i))
+        for i in (40, 41):
+            self.store.append('gaps', 100.0, volume=1, day=DAY - timedelta(days=i))
+        self.store.flush()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_rolling_stats_skip_gaps(self):
+        stats = self.store.rolling_stats(day=DAY)
+        full, gaps = self.store.rows['full'], self.store.rows['gaps']
+        self.assertEqual(int(stats['days_7'][full]), 7)
+        self.assertAlmostEqual(float(stats['avg_price_7_days'][full]), (10.0 * 6 + 11.0) / 7, places=4)
+        self.assertEqual(int(stats['sold_7_days'][full]), 2 * 6 + 3)
+        self.assertEqual(int(stats['days_7'][gaps]), 3)
+        self.assertAlmostEqual(float(stats['avg_price_7_days'][gaps]), 6.0, places=4)
+        self.assertEqual(int(stats['sold_7_days'][gaps]), 3)
+        # the observations before the 30 days window are left out
+        self.assertEqual(int(stats['days_30'][gaps]), 3)
+        self.assertAlmostEqual(float(stats['avg_price_30_days'][gaps]), 6.0, places=4)
+
+    def test_update_writes_null_below_min_days(self):
+        for md5 in ('full', 'gaps'):
+            MarketItem.objects.create(md5=md5, market_name=md5, avg_price_7_days=1.0, avg_price_30_days=1.0)
+        update_market_item_stats(store=self.store, day=DAY)
+        full = MarketItem.objects.get(md5='full')
+        self.assertAlmostEqual(full.history_avg_7_days, round((10.0 * 6 + 11.0) / 7, 2))
+        self.assertEqual(full.history_sold_7_days, 15)
+        self.assertEqual(full.history_days_30, 7)
+        # 7 observed days are below PRICE_MIN_DAYS_30
+        self.assertIsNone(full.history_avg_30_days)
+        gaps = MarketItem.objects.get(md5='gaps')
+        self.assertIsNone(gaps.history_avg_7_days)
+        self.assertIsNone(gaps.history_sold_7_days)
+        self.assertEqual(gaps.history_days_30, 3)
+        # the upstream fields are left alone
+        self.assertEqual(gaps.avg_price_7_days, 1.0)
+        self.assertEqual(gaps.avg_price_30_days, 1.0)
+
+    def test_reader_follows_capacity_growth(self):
+        reader = PriceHistoryStore(path=self.path, epoch=EPOCH, days=128, readonly=True)
+        self.assertIsNotNone(reader.history('full', days=7, day=DAY))
+        self.assertIsNone(reader.history('new99', days=7, day=DAY))
+        # more items than the initial capacity, the writer grows the files
+        for i in range(100):
+            self.store.append('new{0}'.format(i), float(i), volume=1, day=DAY)
+        self.store.flush()
+        index = os.path.join(self.path, 'index.json')
+        mtime = os.path.getmtime(index) + 1
+        os.utime(index, (mtime, mtime))
+        price, count, volume = reader.history('new99', days=7, day=DAY)
+        self.assertEqual(float(price[-1]), 99.0)
+        self.assertEqual(float(count[-1]), 1.0)
+        self.assertEqual(len(reader.md5s), 102)
+        with self.assertRaises(ValueError):
+            reader.append('full', 1.0, day=DAY)
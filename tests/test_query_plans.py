@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from django.test import TestCase
+
+from betting.common_data import TradeStatus
+from betting.management.commands.check_query_plans import HOT_QUERIES, explain_query
+from betting.models import Announcement, GiveAway, SendRecord, Deposit, CoinFlipGame, TempGameHash
+from betting.tests.factories import make_steamers
+
+
+SEED_ROWS = 400
+
+
+class QueryPlanTest(TestCase):
+    """
+    The hot queries on a seeded database, the values are spread so an index on
+    the filter is selective and the planner has no reason to scan.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        steamers = make_steamers(20)
+        statuses = [s.value for s in TradeStatus]
+        games = CoinFlipGame.prepare_bulk([
+            CoinFlipGame(hash='h{0}'.format(i), secret='s{0}'.format(i), status=i % 7, game_type=i % 2, end=i % 2)
+            for i in range(SEED_ROWS)])
+        CoinFlipGame.objects.bulk_create(games)
+        game_ids = list(CoinFlipGame.objects.values_list('id', flat=True))
+        Deposit.objects.bulk_create(Deposit.prepare_bulk([
+            Deposit(steamer=steamers[i % len(steamers)], game_id=game_ids[i % len(game_ids)],
+                    status=statuses[i % len(statuses)], tickets_begin=i)
+            for i in range(SEED_ROWS * 2)]))
+        SendRecord.objects.bulk_create(SendRecord.prepare_bulk([
+            SendRecord(steamer=steamers[i % len(steamers)], status=statuses[i % len(statuses)])
+            for i in range(SEED_ROWS)]))
+        TempGameHash.objects.bulk_create([
+            TempGameHash(hash='h{0}'.format(i), secret='s{0}'.format(i), used=1 if i % 10 else 0)
+            for i in range(SEED_ROWS)])
+        Announcement.objects.bulk_create(Announcement.prepare_bulk([
+            Announcement(anno_type=i % 5, enable=i % 3 == 0, num=i, content='c', content_en='c', remark='r')
+            for i in range(SEED_ROWS)]))
+        GiveAway.objects.bulk_create(GiveAway.prepare_bulk([
+            GiveAway(title='t', img='http://a/b.png', href='http://a/', button='b', enable=i % 10 == 0, num=i, remark='r')
+            for i in range(SEED_ROWS)]))
+
+    def test_hot_queries_use_their_index(self):
+        failed = {}
+        for name, build, eq_columns, index_columns in HOT_QUERIES:
+            plan, problems = explain_query(build(), eq_columns, index_columns)
+            if problems:
+                failed[name] = (problems, plan)
+        self.assertEqual(failed, {})
+
+    def test_other_index_is_reported(self):
+        # served by the (game, tickets_begin) index, not by the one asked for
+        plan, problems = explain_query(
+            Deposit.objects.filter(game_id=1).order_by('tickets_begin'),
+            ('game_id',), ('steamer_id', 'status', 'create_time'))
+        self.assertNotEqual(problems, [], plan)
+
+    def test_missing_index_is_reported(self):
+        plan, problems = explain_query(
+            SendRecord.objects.filter(steamer_id=1, status=TradeStatus.Initialed.value).order_by('pk')[:1],
+            ('steamer_id', 'status'), ('steamer_id', 'status', 'trade_ts'))
+        self.assertEqual(problems, ['no index on (steamer_id, status, trade_ts)'])
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.test import TestCase, RequestFactory, override_settings
+
+from betting.middleware import SteamUserMiddleware, get_request_user
+from betting.tests.factories import make_steamers
+from betting.views import package_view
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class RequestUserTest(TestCase):
+
+    def setUp(self):
+        self.steamer = make_steamers(1)[0]
+        self.factory = RequestFactory()
+
+    def _request(self, path='/'):
+        request = self.factory.get(path)
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore()
+        request.user = self.steamer
+        login(request, self.steamer, backend=settings.AUTHENTICATION_BACKENDS[0])
+        # a fresh request of the logged in session, the user is not loaded yet
+        fresh = self.factory.get(path)
+        fresh.session = request.session
+        AuthenticationMiddleware().process_request(fresh)
+        SteamUserMiddleware().process_request(fresh)
+        return fresh
+
+    def test_user_is_loaded_once(self):
+        request = self._request()
+        with self.assertNumQueries(1):
+            self.assertEqual(request.user.pk, self.steamer.pk)
+            self.assertEqual(get_request_user(request).pk, self.steamer.pk)
+            self.assertTrue(request.user.is_authenticated())
+
+    def test_package_page_queries(self):
+        request = self._request('/profile/package/')
+        # the user, then the last initialed send record, get_initial and
+        # get_context_data both read the user
+        with self.assertNumQueries(2):
+            response = package_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['last_order'], '')
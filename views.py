@@ -6,23 +6,17 @@ import logging
 from django.utils.translation import ugettext as _, ugettext_lazy as _l
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
+from django.db import transaction, IntegrityError
+from django.http import StreamingHttpResponse
 from django.urls import reverse_lazy
 from django.views.generic import TemplateView, FormView, ListView, DetailView
 from rest_framework import views
 from rest_framework import viewsets, mixins
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 
 from betting.common_data import TradeStatus, GameType
-from betting.betting_business import get_all_coinflip_history, create_promotion, get_promotion_count
-from betting.betting_business import get_my_coinflip_history, get_my_jackpot_history
-from betting.business.deposit_business import join_coinflip_game, join_jackpot_game, ws_send_cf_news, create_random_hash, getWins, get_ranks
-from betting.business.steam_business import get_user_inventories
-from betting.business.cache_manager import update_coinflip_game_in_cache, get_current_jackpot_id, get_steam_bot_status
-from betting.forms import TradeUrlForm
 from betting.models import Deposit, CoinFlipGame, Announcement, UserProfile, SendRecord, GiveAway
-from betting.serializers import DepositSerializer, AnnouncementSerializer, SteamerSerializer, GiveawaySerializer
-from betting.utils import current_user, reformat_ret, get_maintenance, get_string_config_from_site_config
-from betting.business.check_lack import check_lack
+from betting.utils import reformat_ret, get_string_config_from_site_config
 
 from social_auth.models import SteamUser
 from django.conf import settings
@@ -31,7 +25,14 @@ from django.conf import settings
 _logger = logging.getLogger(__name__)
 
 
+# The business modules, serializers and forms are imported where they are used,
+# as the first statement of the view method, inside its try when it has one so an
+# import error gets the error envelope. Workers serving only the static pages never
+# load them, betting.warmup loads them all in the master process before fork.
+
+
 def get_announcement(anno_type):
+    from betting.serializers import AnnouncementSerializer
     ret = None
     announ = Announcement.objects.filter(anno_type=anno_type, enable=True).order_by('num').first()
     if announ:
@@ -40,6 +41,7 @@ def get_announcement(anno_type):
 
 
 def get_giveaway():
+    from betting.serializers import GiveawaySerializer
     ret = None
     give = GiveAway.objects.filter(enable=True).order_by('num').first()
     if give:
@@ -48,12 +50,12 @@ def get_giveaway():
 
 
 def format_ranking_list(type='win', days=0):
-    users = SteamUser.objects.filter(is_active=True)
+    from betting.business.stat_business import get_users_wins
+    from betting.serializers import SteamerSerializer
     ranking_list = []
-    for user in users:
-        times, wpct, cost, income = getWins(steamer=user, days=days)
+    for steamer_id, (times, wpct, cost, income) in get_users_wins(days=days).items():
         info = {
-            'user': SteamerSerializer(user).data,
+            'user': steamer_id,
             'income': income,
             'wpct': wpct
         }
@@ -67,10 +69,13 @@ def format_ranking_list(type='win', days=0):
         ranking_list = [elem for elem in ranking_list if elem['income'] < 0]
         ranking_list.sort(key=lambda k: (k['income'], k['wpct']))
 
+    # only the listed users are loaded, with one query
+    ranking_list = ranking_list[0:10]
+    users = SteamUser.objects.in_bulk([elem['user'] for elem in ranking_list])
+    for elem in ranking_list:
+        elem['user'] = SteamerSerializer(users[elem['user']]).data
     length = len(ranking_list)
-    if length > 10:
-        ranking_list = ranking_list[0:10]
-    elif length < 10:
+    if length < 10:
         info_blank = {
             'user': {
                 'name': u'未上榜'
@@ -88,6 +93,7 @@ class HomePageView(TemplateView):
     template_name = 'pages/home.html'
 
     def get_context_data(self, **kwargs):
+        from betting.betting_business import create_promotion
         if self.request.user.is_anonymous():
             ref_code = self.request.GET.get('ref', None)
             if ref_code:
@@ -119,8 +125,8 @@ class CoinFlipView(TemplateView):
     template_name = 'pages/coinflip.html'
 
     def get_context_data(self, **kwargs):
+        from betting.business.deposit_business import get_ranks
         context = super(CoinFlipView, self).get_context_data(**kwargs)
-        user = current_user(self.request)
         context['banner'] = get_announcement(0)
         context['promotion'] = get_announcement(1)
         context['nbar'] = 'coinflip'
@@ -134,8 +140,8 @@ class JackpotView(TemplateView):
     template_name = 'pages/jackpot.html'
 
     def get_context_data(self, **kwargs):
+        from betting.business.deposit_business import get_ranks
         context = super(JackpotView, self).get_context_data(**kwargs)
-        user = current_user(self.request)
         context['banner'] = get_announcement(0)
         context['promotion'] = get_announcement(1)
         context['nbar'] = 'jackpot'
@@ -166,6 +172,41 @@ class PlayFairView(TemplateView):
 provably_fair = PlayFairView.as_view()
 
 
+class BatchVerifyView(views.APIView):
+    permission_classes = (AllowAny,)
+
+    def post(self, request, format=None):
+        try:
+            from betting.business.export_business import parse_export_date
+            from betting.business.fair_business import verify_games
+            uids = request.data.get('uids', None)
+            start = parse_export_date(request.data.get('start', None))
+            end = parse_export_date(request.data.get('end', None))
+            if uids is not None and not isinstance(uids, list):
+                return reformat_ret(103, {}, "invalid params")
+            if not uids and not (start and end):
+                return reformat_ret(103, {}, "invalid params")
+            after = request.data.get('cursor', None)
+            results, mismatches, cursor = verify_games(uids=uids or None, start=start, end=end,
+                                                       after=int(after) if after else None)
+            resp_data = {
+                'total': len(results),
+                'mismatches': mismatches,
+                'results': results,
+                'truncated': cursor is not None,
+                'cursor': cursor
+            }
+            return reformat_ret(0, resp_data, 'success')
+        except ValueError as e:
+            _logger.error(e)
+            return reformat_ret(103, {}, "invalid params")
+        except Exception as e:
+            _logger.exception(e)
+            return reformat_ret(500, {}, 'verify exception')
+
+batch_verify_view = BatchVerifyView.as_view()
+
+
 class GetStartedView(TemplateView):
     template_name = 'common/site/get_started.html'
 
@@ -181,23 +222,26 @@ terms_of_service = TermsOfServiceView.as_view()
 class ProfileView(LoginRequiredMixin, SuccessMessageMixin, FormView):
     login_url = reverse_lazy('social:begin', args=('steam',))
     redirect_field_name = 'redirect_to'
-    form_class = TradeUrlForm
 
     success_message = "Successfully modified your trade url."
 
+    def get_form_class(self):
+        from betting.forms import TradeUrlForm
+        return TradeUrlForm
+
     def get_success_url(self):
         return self.request.path
 
     def get_initial(self):
         resp = {}
-        user = current_user(self.request)
-        if user:
+        user = self.request.user
+        if user.is_authenticated():
             resp['tradeUrl'] = user.tradeurl
         return resp
 
     def form_valid(self, form):
-        user = current_user(self.request)
-        if user:
+        user = self.request.user
+        if user.is_authenticated():
             user.tradeurl = form.data['tradeUrl']
             user.save()
         return super(ProfileView, self).form_valid(form)
@@ -216,10 +260,10 @@ class PackageView(ProfileView):
         context = super(PackageView, self).get_context_data(**kwargs)
         last_order = ''
         security_code = ''
-        user = current_user(self.request)
-        if user and user.is_authenticated():
+        user = self.request.user
+        if user.is_authenticated():
             record = SendRecord.objects.filter(
-                steamer__steamid=user.steamid,
+                steamer=user,
                 status=TradeStatus.Initialed.value
             ).first()
             if record:
@@ -259,12 +303,14 @@ class JoinJackpotView(views.APIView):
     def create(self, request):
         # _logger.debug('create deposit')
         try:
+            from betting.business.deposit_business import join_jackpot_game
+            from betting.business.snapshots import get_maintenance
             m = get_maintenance()
             if m:
                 return reformat_ret(201, [], _('The site in on maintenance, please wait for a while.'))
 
-            steamer = current_user(request)
-            if steamer:
+            steamer = request.user
+            if steamer.is_authenticated():
                 code, result = join_jackpot_game(request.data, steamer)
                 if code == 0:
                     return reformat_ret(0, {'uid': result.uid}, _l('join jackpot successfully'))
@@ -285,12 +331,14 @@ class JoinCoinflipView(views.APIView):
 
     def create(self, request):
         try:
+            from betting.business.deposit_business import join_coinflip_game
+            from betting.business.snapshots import get_maintenance
             m = get_maintenance()
             if m:
                 return reformat_ret(201, [], _('The site in on maintenance, please wait for a while.'))
 
-            steamer = current_user(request)
-            if steamer:
+            steamer = request.user
+            if steamer.is_authenticated():
                 code, result = join_coinflip_game(request.data, steamer)
                 if code == 0:
                     return reformat_ret(0, result, 'create coinflip successfully')
@@ -316,7 +364,8 @@ class InventoryQueryView(views.APIView):
 
     def get_inventories(self, request):
         try:
-            steamer = current_user(request)
+            from betting.business.steam_business import get_user_inventories
+            steamer = request.user
             s_assetid = request.query_params.get('s_assetid', None)
             items = get_user_inventories(steamer.steamid, s_assetid, lang=request.LANGUAGE_CODE)
             if items is None:
@@ -343,8 +392,9 @@ class CoinflipHistoryQueryView(views.APIView):
 
     def query_history(self, request):
         try:
+            from betting.betting_business import get_all_coinflip_history, get_my_coinflip_history, get_my_jackpot_history
             ret = []
-            user = current_user(request)
+            user = request.user
             game = request.data.get('game', 'coinflip')
             q_type = request.data.get('type', 'all')
             page = request.data.get('page', 1)
@@ -352,7 +402,7 @@ class CoinflipHistoryQueryView(views.APIView):
             if q_type == 'all':
                 if game == 'coinflip':
                     ret = get_all_coinflip_history(page=page)
-            elif q_type == 'myself' and user:
+            elif q_type == 'myself' and user.is_authenticated():
                 if game == 'coinflip':
                     ret = get_my_coinflip_history(user, page=page)
                 elif game == 'jackpot':
@@ -425,6 +475,7 @@ class CreateRandomHashView(views.APIView):
 
     def get(self, request, format=None):
         try:
+            from betting.business.deposit_business import create_random_hash
             count = request.query_params.get('count', 10000)
             create_random_hash(count)
             return reformat_ret(0, {'count': count}, 'new hash success')
@@ -439,15 +490,15 @@ class UpdateThemeView(views.APIView):
 
     def post(self, request, format=None):
         try:
-            user = current_user(request)
+            user = request.user
             theme = request.data.get('theme', 'light')
             if user.is_authenticated():
-                if hasattr(user, 'profile'):
-                    profile = user.profile
-                    profile.theme = theme
-                    profile.save()
-                else:
-                    UserProfile.objects.create(steamer=user, theme=theme)
+                if not UserProfile.objects.filter(steamer=user).update(theme=theme):
+                    try:
+                        with transaction.atomic():
+                            UserProfile.objects.create(steamer=user, theme=theme)
+                    except IntegrityError:
+                        UserProfile.objects.filter(steamer=user).update(theme=theme)
             return reformat_ret(0, {}, 'update theme success')
         except Exception as e:
             _logger.exception(e)
@@ -461,6 +512,7 @@ class QueryUserLack(views.APIView):
 
     def get(self, request, format=None):
         try:
+            from betting.business.check_lack import check_lack
             params = request.query_params
             botid = params.get('botid')
             appid = params.get('appid')
@@ -483,8 +535,9 @@ class AffiliatePageView(TemplateView):
     template_name = 'pages/affiliate.html'
 
     def get_context_data(self, **kwargs):
+        from betting.betting_business import get_promotion_count
         context = super(AffiliatePageView, self).get_context_data(**kwargs)
-        user = current_user(self.request)
+        user = self.request.user
         ref_point = 0
         ref_count = 0
         if not user.is_anonymous():
@@ -496,3 +549,59 @@ class AffiliatePageView(TemplateView):
 
 
 affiliate_page_view = AffiliatePageView.as_view()
+
+
+class ExportRecordsView(views.APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, target, format=None):
+        try:
+            from betting.business.export_business import EXPORT_MODELS, EXPORT_FORMATS, iter_export_lines, parse_export_date
+            params = request.query_params
+            fmt = params.get('format', 'csv')
+            if target not in EXPORT_MODELS or fmt not in EXPORT_FORMATS:
+                return reformat_ret(103, {}, "invalid params")
+            game_type = params.get('game_type', None)
+            filters = {
+                'start': parse_export_date(params.get('start', None)),
+                'end': parse_export_date(params.get('end', None)),
+                'game_type': int(game_type) if game_type not in (None, '') else None
+            }
+        except ValueError as e:
+            _logger.error(e)
+            return reformat_ret(103, {}, "invalid params")
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        resp = StreamingHttpResponse(iter_export_lines(target, fmt=fmt, **filters), content_type=content_type)
+        resp['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(target, fmt)
+        return resp
+
+
+export_records_view = ExportRecordsView.as_view()
+
+
+class PriceHistoryView(views.APIView):
+    permission_classes = (AllowAny,)
+
+    def get(self, request, format=None):
+        try:
+            from betting.business.price_history import get_price_store
+            md5 = request.query_params.get('md5', None)
+            days = min(int(request.query_params.get('days', 30)), 365)
+            history = get_price_store().history(md5, days=days) if md5 else None
+            if history is None:
+                return reformat_ret(103, {}, "invalid params")
+            price, count, volume = history
+            resp_data = {
+                'price': [round(float(p), 2) if c else None for p, c in zip(price, count)],
+                'volume': volume.astype(int).tolist()
+            }
+            return reformat_ret(0, resp_data, 'success')
+        except ValueError as e:
+            _logger.error(e)
+            return reformat_ret(103, {}, "invalid params")
+        except Exception as e:
+            _logger.exception(e)
+            return reformat_ret(500, {}, 'query price history exception')
+
+
+price_history_view = PriceHistoryView.as_view()
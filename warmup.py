@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import logging
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.urls import get_resolver
+from django.utils import translation
+
+
+_logger = logging.getLogger(__name__)
+
+WARMUP_MODULES = (
+    'betting.betting_business',
+    'betting.business.deposit_business',
+    'betting.business.steam_business',
+    'betting.business.cache_manager',
+    'betting.business.check_lack',
+    'betting.business.stat_business',
+    'betting.business.inventory_client',
+    'betting.business.fair_business',
+    'betting.business.export_business',
+    'betting.business.price_history',
+    'betting.business.snapshots',
+    'betting.serializers',
+    'betting.forms',
+)
+
+WARMUP_TEMPLATES = (
+    'pages/home.html',
+    'pages/coinflip.html',
+    'pages/jackpot.html',
+    'pages/play_fair.html',
+    'common/site/support.html',
+    'common/site/terms_of_service.html',
+)
+
+
+def warmup():
+    """
+    Loads the lazily imported modules, the site config snapshot, the index of the
+    price history, url patterns, translation catalogs and templates in the master
+    process, so forked workers share them copy-on-write. A module which fails to
+    import stops the boot, as it did when views imported them at load time. See
+    when_ready for the gunicorn hook.
+    """
+    begin = time.time()
+    for name in WARMUP_MODULES:
+        import_module(name)
+    from betting.business.snapshots import load_config_snapshot
+    from betting.business.price_history import get_price_store
+    load_config_snapshot()
+    _logger.info('warmup loaded price history of %s items', len(get_price_store().md5s))
+    get_resolver().url_patterns
+    for code, _ in getattr(settings, 'LANGUAGES', ()):
+        translation.activate(code)
+    translation.deactivate()
+    for name in WARMUP_TEMPLATES:
+        try:
+            get_template(name)
+        except TemplateDoesNotExist as e:
+            _logger.warning('warmup template %s failed: %s', name, e)
+    # the workers must not inherit the connections opened by the master
+    connections.close_all()
+    _logger.info('warmup done in %.3fs', time.time() - begin)
+
+
+def when_ready(server):
+    """
+    gunicorn hook, runs in the master after the app is loaded and before the
+    first worker is forked. In the gunicorn config:
+
+        preload_app = True
+        from betting.warmup import when_ready
+    """
+    warmup()